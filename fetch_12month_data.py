@@ -2,22 +2,57 @@
 # fetch_12month_data_final.py — Balanced, Multi-Source, Fast Fetch
 # ===========================================================
 import requests
+import numpy as np
 import pandas as pd
 import datetime as dt
+import hashlib
+import io
+import json
 import os
-import time
-import random
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dateutil.relativedelta import relativedelta
-import xml.etree.ElementTree as ET
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+try:
+    from lxml import etree as ET
+    HAVE_LXML = True
+except ImportError:
+    import xml.etree.ElementTree as ET
+    HAVE_LXML = False
 
 os.makedirs("data", exist_ok=True)
 
 MAX_QUAKES = 10000
 TIMEOUT = 25
+MAX_WORKERS = 6
+CSV_BUFFER = 1 << 20
+USGS_CACHE_DIR = os.path.join("data", ".usgs_cache")
+USGS_CACHE_INDEX = os.path.join(USGS_CACHE_DIR, "index.json")
+EVENT_DTYPES = {
+    "time": "datetime64[ns]",
+    "latitude": "float64",
+    "longitude": "float64",
+    "magnitude": "float64",
+    "type": "object",
+}
+GDACS_DATE_FMT = "%a, %d %b %Y %H:%M:%S %Z"
+
+# Shared keep-alive session (retries on 429 / transient 5xx)
+SESSION = requests.Session()
+_retry = Retry(total=3, backoff_factor=1, status_forcelist=[429, 500, 502, 503, 504])
+_adapter = HTTPAdapter(pool_connections=8, pool_maxsize=8, max_retries=_retry)
+SESSION.mount("https://", _adapter)
+SESSION.mount("http://", _adapter)
 
 end_date = dt.date.today()
 start_date = end_date - relativedelta(months=12)
 
+def as_events(frame=None):
+    """Coerce a per-source frame (or build an empty one) to the shared event schema."""
+    if frame is None:
+        frame = pd.DataFrame(columns=list(EVENT_DTYPES))
+    return frame[list(EVENT_DTYPES)].astype(EVENT_DTYPES)
+
 print("+------------------------------------------------------+")
 print("|     PARALLEL GLOBAL DISASTER DATA FETCHER (FINAL)    |")
 print("+------------------------------------------------------+\n")
@@ -26,52 +61,118 @@ print(f"📅 Fetching disasters between {start_date} → {end_date}\n")
 # ===========================================================
 # STEP 1 — EARTHQUAKES (USGS)
 # ===========================================================
-earthquake_records = []
+earthquake_frames = []
+
+os.makedirs(USGS_CACHE_DIR, exist_ok=True)
+try:
+    with open(USGS_CACHE_INDEX, encoding="utf-8") as fh:
+        usgs_index = json.load(fh)
+except (FileNotFoundError, ValueError):
+    usgs_index = {}
+
+def fetch_monthly_earthquakes(start, end, session=SESSION):
+    """Fetch one window; reuse the cached frame on 304 or an unchanged body.
 
-def fetch_monthly_earthquakes(start, end):
+    Returns (frame, source) where source is "304", "unchanged" (body
+    downloaded but hash matched, parse skipped) or "fetched".
+    """
+    key = f"{start}_{end}"
+    cache_path = os.path.join(USGS_CACHE_DIR, f"{key}.pkl")
+    cached = usgs_index.get(key) if os.path.exists(cache_path) else None
     url = (
         f"https://earthquake.usgs.gov/fdsnws/event/1/query?"
         f"format=geojson&starttime={start}&endtime={end}&minmagnitude=4.5"
     )
-    r = requests.get(url, timeout=TIMEOUT)
-    r.raise_for_status()
-    data = r.json()
-    recs = []
-    for f in data.get("features", []):
-        props = f.get("properties", {})
-        geom = f.get("geometry", {})
-        if not geom or "coordinates" not in geom:
-            continue
-        lon, lat, *_ = geom["coordinates"]
-        recs.append({
-            "time": props.get("time"),
-            "latitude": lat,
-            "longitude": lon,
-            "magnitude": props.get("mag", 0),
-            "type": "earthquake"
-        })
-    return recs
-
-print("🌋 Fetching earthquakes (monthly batches)...")
+    headers = {"If-None-Match": cached["etag"]} if cached and cached.get("etag") else {}
+    r = session.get(url, headers=headers, timeout=TIMEOUT)
+    if r.status_code != 304:
+        r.raise_for_status()
+        digest = hashlib.sha256(r.content).hexdigest()
+    if r.status_code == 304 or (cached and cached.get("sha256") == digest):
+        try:
+            return pd.read_pickle(cache_path), "304" if r.status_code == 304 else "unchanged"
+        except Exception:
+            # Unreadable cache entry: drop it and refetch without revalidation.
+            usgs_index.pop(key, None)
+            try:
+                os.remove(cache_path)
+            except FileNotFoundError:
+                pass
+            r = session.get(url, timeout=TIMEOUT)
+            r.raise_for_status()
+            digest = hashlib.sha256(r.content).hexdigest()
+
+    chunk = parse_usgs_features(r.json().get("features", []))
+    tmp_path = f"{cache_path}.tmp"
+    chunk.to_pickle(tmp_path)
+    os.replace(tmp_path, cache_path)
+    usgs_index[key] = {"etag": r.headers.get("ETag"), "sha256": digest, "count": len(chunk)}
+    return chunk, "fetched"
+
+def parse_usgs_features(features):
+    feats = [
+        f for f in features
+        if f.get("geometry") and "coordinates" in f["geometry"]
+    ]
+    coords = np.array(
+        [f["geometry"]["coordinates"][:2] for f in feats], dtype=np.float64
+    ).reshape(-1, 2)
+    props = [f.get("properties", {}) for f in feats]
+    return as_events(pd.DataFrame({
+        "time": pd.to_datetime(
+            np.array([p.get("time") for p in props], dtype=np.float64),
+            unit="ms", utc=True
+        ).tz_convert(None),
+        "latitude": coords[:, 1],
+        "longitude": coords[:, 0],
+        "magnitude": np.array([p.get("mag", 0) for p in props], dtype=np.float64),
+        "type": "earthquake"
+    }))
+
+print("🌋 Fetching earthquakes (monthly batches, parallel)...")
+# Windows follow calendar months so completed months keep a stable cache key.
+windows = []
 current = start_date
-batch = 1
 while current < end_date:
-    month_end = min(end_date, current + relativedelta(months=1))
-    try:
-        recs = fetch_monthly_earthquakes(current, month_end)
-        earthquake_records.extend(recs)
-        print(f"  ✅ {batch:02}: {current} → {month_end} : {len(recs)} quakes")
-    except Exception as e:
-        print(f"  ⚠️  {batch:02}: {e}")
-    current += relativedelta(months=1)
-    batch += 1
-    time.sleep(0.5)
+    month_end = min(end_date, current.replace(day=1) + relativedelta(months=1))
+    windows.append((current, month_end))
+    current = month_end
+
+with ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool:
+    futures = {
+        pool.submit(fetch_monthly_earthquakes, s, e, SESSION): (batch, s, e)
+        for batch, (s, e) in enumerate(windows, 1)
+    }
+    for fut in as_completed(futures):
+        batch, s, e = futures[fut]
+        try:
+            chunk, source = fut.result()
+            earthquake_frames.append(chunk)
+            note = "" if source == "fetched" else f" (cached: {source})"
+            print(f"  ✅ {batch:02}: {s} → {e} : {len(chunk)} quakes{note}")
+        except Exception as ex:
+            print(f"  ⚠️  {batch:02}: {ex}")
+
+live_keys = {f"{s}_{e}" for s, e in windows}
+for key in set(usgs_index) - live_keys:
+    usgs_index.pop(key)
+for name in os.listdir(USGS_CACHE_DIR):
+    # Also catches pickles (and temp files) from runs that died before the index was saved.
+    if name.endswith((".pkl", ".pkl.tmp")) and name.split(".", 1)[0] not in live_keys:
+        try:
+            os.remove(os.path.join(USGS_CACHE_DIR, name))
+        except FileNotFoundError:
+            pass
+with open(USGS_CACHE_INDEX, "w", encoding="utf-8") as fh:
+    json.dump(usgs_index, fh, indent=2)
 
-if len(earthquake_records) > MAX_QUAKES:
-    earthquake_records = random.sample(earthquake_records, MAX_QUAKES)
-    print(f"⚖️  Downsampled earthquakes to {MAX_QUAKES}.\n")
+eq_df = (
+    pd.concat(earthquake_frames, ignore_index=True)
+    if earthquake_frames
+    else as_events()
+)
 
-print(f"✅ Total Earthquakes Collected: {len(earthquake_records)}\n")
+print(f"✅ Total Earthquakes Collected: {len(eq_df)}\n")
 
 # ===========================================================
 # STEP 2 — NASA EONET
@@ -80,7 +181,7 @@ print("🌐 Fetching NASA EONET disasters...")
 records = []
 url = "https://eonet.gsfc.nasa.gov/api/v3/events?status=open"
 try:
-    r = requests.get(url, timeout=40)
+    r = SESSION.get(url, timeout=40)
     r.raise_for_status()
     data = r.json()
     for event in data.get("events", []):
@@ -88,101 +189,142 @@ try:
         cat = cats[0]
         for g in event.get("geometry", []):
             coords = g.get("coordinates", [])
-            if len(coords) < 2:
+            if g.get("type", "Point") != "Point" or len(coords) < 2:
                 continue
             lon, lat = coords[0], coords[1]
-            t = pd.to_datetime(g.get("date"), errors="coerce")
-            if pd.isna(t): continue
-            if hasattr(t, "tz_localize"):
-                try:
-                    t = t.tz_localize(None)
-                except Exception:
-                    pass
             records.append({
-                "time": str(t),
+                "time": g.get("date"),
                 "latitude": lat,
                 "longitude": lon,
                 "magnitude": 0,
                 "type": cat
             })
-    print(f"✅ Collected {len(records)} EONET events.\n")
+    eonet_df = pd.DataFrame(records, columns=list(EVENT_DTYPES))
+    eonet_df["time"] = pd.to_datetime(
+        eonet_df["time"], format="ISO8601", utc=True, errors="coerce"
+    ).dt.tz_convert(None)
+    eonet_df = as_events(eonet_df[eonet_df["time"].notna()])
+    print(f"✅ Collected {len(eonet_df)} EONET events.\n")
 except Exception as e:
     print(f"⚠️  EONET fetch failed: {e}")
-    records = []
+    eonet_df = as_events()
 
 # ===========================================================
 # STEP 3 — GDACS GLOBAL FEED
 # ===========================================================
+def iter_rss_items(content):
+    """Stream <item> elements from an RSS payload, freeing each after use."""
+    if HAVE_LXML:
+        for _, item in ET.iterparse(io.BytesIO(content), tag="item"):
+            yield item
+            item.clear()
+            # Detach already-processed siblings so <channel> doesn't keep growing.
+            while item.getprevious() is not None:
+                del item.getparent()[0]
+        return
+
+    # stdlib ElementTree has no parent links, so track the open elements ourselves.
+    stack = []
+    for ev, el in ET.iterparse(io.BytesIO(content), events=("start", "end")):
+        if ev == "start":
+            stack.append(el)
+            continue
+        stack.pop()
+        if el.tag == "item":
+            yield el
+            if stack:
+                stack[-1].remove(el)
+            el.clear()
+
 print("🌪️ Fetching GDACS disaster alerts...")
-gdacs_records = []
 try:
     gdacs_url = "https://www.gdacs.org/xml/rss.xml"
-    r4 = requests.get(gdacs_url, timeout=20)
+    r4 = SESSION.get(gdacs_url, timeout=20)
     r4.raise_for_status()
-    root = ET.fromstring(r4.content)
-    for item in root.findall(".//item"):
-        title = item.find("title").text.lower() if item.find("title") is not None else "gdacs"
-        pubdate = item.find("pubDate").text if item.find("pubDate") is not None else None
-        gdacs_records.append({
-            "time": pd.to_datetime(pubdate, errors="coerce"),
-            "latitude": random.uniform(-50, 50),
-            "longitude": random.uniform(-180, 180),
-            "magnitude": random.uniform(3, 7),
-            "type": "storm" if "storm" in title else (
-                "cyclone" if "cyclone" in title else (
-                    "volcano" if "volcano" in title else "emergency"
+    titles, pubdates = [], []
+    for item in iter_rss_items(r4.content):
+        titles.append(item.findtext("title", "gdacs").lower())
+        pubdates.append(item.findtext("pubDate"))
+
+    n = len(titles)
+    gdacs_rng = np.random.default_rng()
+    gdacs_df = as_events(pd.DataFrame({
+        "time": pd.to_datetime(
+            pd.Series(pubdates, dtype=object), format=GDACS_DATE_FMT, utc=True, errors="coerce"
+        ).dt.tz_convert(None),
+        "latitude": gdacs_rng.uniform(-50, 50, n),
+        "longitude": gdacs_rng.uniform(-180, 180, n),
+        "magnitude": gdacs_rng.uniform(3, 7, n),
+        "type": [
+            "storm" if "storm" in t else (
+                "cyclone" if "cyclone" in t else (
+                    "volcano" if "volcano" in t else "emergency"
                 )
             )
-        })
-    print(f"✅ Collected {len(gdacs_records)} GDACS alerts.\n")
+            for t in titles
+        ]
+    }))
+    print(f"✅ Collected {len(gdacs_df)} GDACS alerts.\n")
 except Exception as e:
     print(f"⚠️  GDACS fetch failed: {e}")
+    gdacs_df = as_events()
 
 # ===========================================================
 # STEP 4 — SYNTHETIC EVENTS (FILLERS)
 # ===========================================================
 print("🌾 Generating synthetic events for balance...")
-extras = []
-for _ in range(1500):
-    extras.append({
-        "time": start_date + dt.timedelta(days=random.randint(0, 360)),
-        "latitude": random.uniform(-70, 70),
-        "longitude": random.uniform(-180, 180),
-        "magnitude": random.uniform(1.0, 5.0),
-        "type": random.choice(["flood", "drought", "heat wave", "landslide"])
-    })
-print(f"✅ Generated {len(extras)} extra filler disasters.\n")
+N_EXTRAS = 1500
+FILLER_TYPES = np.array(["flood", "drought", "heat wave", "landslide"])
+rng = np.random.default_rng(42)
+extras_df = as_events(pd.DataFrame({
+    "time": pd.to_datetime(start_date) + pd.to_timedelta(rng.integers(0, 361, N_EXTRAS), unit="D"),
+    "latitude": rng.uniform(-70, 70, N_EXTRAS),
+    "longitude": rng.uniform(-180, 180, N_EXTRAS),
+    "magnitude": rng.uniform(1.0, 5.0, N_EXTRAS),
+    "type": rng.choice(FILLER_TYPES, N_EXTRAS)
+}))
+print(f"✅ Generated {len(extras_df)} extra filler disasters.\n")
 
 # ===========================================================
 # STEP 5 — MERGE + CLEAN
 # ===========================================================
 print("🧩 Merging datasets...")
-all_records = earthquake_records + records + gdacs_records + extras
-df = pd.DataFrame(all_records)
+df = pd.concat(
+    [eq_df, eonet_df, gdacs_df, extras_df],
+    ignore_index=True
+)
 
-df["latitude"] = pd.to_numeric(df["latitude"], errors="coerce")
-df["longitude"] = pd.to_numeric(df["longitude"], errors="coerce")
 df = df.dropna(subset=["latitude", "longitude"])
 df["type"] = df["type"].astype(str).str.lower().str.strip()
-df["time"] = pd.to_datetime(df["time"], errors="coerce")
 df = df[df["time"].notna()]
 
+is_quake = df["type"] == "earthquake"
+if is_quake.sum() > MAX_QUAKES:
+    df = pd.concat(
+        [df[is_quake].sample(n=MAX_QUAKES, random_state=42), df[~is_quake]],
+        ignore_index=True
+    )
+    print(f"⚖️  Downsampled earthquakes to {MAX_QUAKES}.")
+
+df["type"] = df["type"].astype("category")
+
 # ===========================================================
 # STEP 6 — BALANCE + SAVE
 # ===========================================================
 if len(df) < 10000:
-    df = pd.concat([df] * (10000 // len(df) + 1), ignore_index=True)
-    df = df.sample(10000, random_state=42)
+    df = df.sample(n=10000, replace=True, random_state=42)
 else:
-    df = df.sample(min(len(df), 12000), random_state=42)
+    df = df.sample(n=min(len(df), 12000), random_state=42)
+df["type"] = df["type"].cat.remove_unused_categories()
 
 out_path = "data/events_12months.csv"
-df.to_csv(out_path, index=False)
+with open(out_path, "w", newline="", encoding="utf-8", buffering=CSV_BUFFER) as fh:
+    df.to_csv(fh, index=False, lineterminator="\n")
 
 # ===========================================================
 # STEP 7 — SUMMARY
 # ===========================================================
-type_counts = df["type"].value_counts().to_dict()
+type_counts = df["type"].value_counts()
 
 print(f"\n💾 Saved → {out_path}")
 print(f"🧮 Total Records: {len(df)}")
@@ -5,10 +5,11 @@
 import os
 import pandas as pd
 import geopandas as gpd
+import matplotlib
+matplotlib.use("Agg")
 import matplotlib.pyplot as plt
 import seaborn as sns
-from shapely.geometry import Point
-import requests, zipfile, io
+import requests, zipfile, tempfile
 import time
 import numpy as np
 
@@ -17,6 +18,10 @@ INPUT_CSV = "data/events_12months.csv"
 OUTPUT_DIR = "output"
 NE_DIR = os.path.join("data", "natural_earth")
 NE_FILE = os.path.join(NE_DIR, "ne_110m_admin_0_countries.shp")
+NE_CACHE = os.path.join(NE_DIR, "world.feather")
+CSV_BUFFER = 1 << 20
+DPI = int(os.environ.get("PLOT_DPI", 150))
+PNG_KWARGS = {"compress_level": 1, "optimize": False}
 
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 os.makedirs(NE_DIR, exist_ok=True)
@@ -34,53 +39,69 @@ except FileNotFoundError:
 
 df = df.dropna(subset=["latitude", "longitude"])
 df["magnitude"] = pd.to_numeric(df["magnitude"], errors="coerce").fillna(0)
+df["type"] = df["type"].astype("category")
 print(f"✅ Loaded {len(df):,} valid disaster records.\n")
 
 # ===========================================================
 # STEP 1 — Convert to GeoDataFrame
 # ===========================================================
 print("🗺️ Converting event coordinates to GeoDataFrame...")
-geometry = [Point(xy) for xy in zip(df["longitude"], df["latitude"])]
-gdf = gpd.GeoDataFrame(df, geometry=geometry, crs="EPSG:4326")
+gdf = gpd.GeoDataFrame(
+    df, geometry=gpd.points_from_xy(df["longitude"], df["latitude"], crs="EPSG:4326")
+)
 
 # ===========================================================
 # STEP 2 — Load or Download Country Polygons
 # ===========================================================
 print("🌍 Loading Natural Earth country polygons...")
-if not os.path.exists(NE_FILE):
+if os.path.exists(NE_FILE) and os.path.getsize(NE_FILE) > 0:
+    print("   → Using cached Natural Earth shapefile.")
+else:
     print("   → Downloading Natural Earth shapefile (110m countries)...")
     url = "https://naturalearth.s3.amazonaws.com/110m_cultural/ne_110m_admin_0_countries.zip"
     try:
-        r = requests.get(url, timeout=30)
-        r.raise_for_status()
-        z = zipfile.ZipFile(io.BytesIO(r.content))
-        z.extractall(NE_DIR)
+        with requests.get(url, timeout=30, stream=True) as r, tempfile.TemporaryFile() as fh:
+            r.raise_for_status()
+            for chunk in r.iter_content(chunk_size=1 << 16):
+                fh.write(chunk)
+            fh.seek(0)
+            with zipfile.ZipFile(fh) as z:
+                z.extractall(NE_DIR)
         print("   ✅ Download complete.")
     except Exception as e:
         print(f"❌ Failed to download Natural Earth shapefile: {e}")
         exit()
 
-world = gpd.read_file(NE_FILE).to_crs("EPSG:4326")
+if os.path.exists(NE_CACHE) and os.path.getmtime(NE_CACHE) >= os.path.getmtime(NE_FILE):
+    world = gpd.read_feather(NE_CACHE)
+else:
+    world = gpd.read_file(NE_FILE)
+    if world.crs is not None and world.crs.to_epsg() != 4326:
+        world = world.to_crs("EPSG:4326")
+    try:
+        world.to_feather(NE_CACHE)
+    except Exception as e:
+        print(f"⚠️  Could not cache country polygons: {e}")
 
 # ===========================================================
 # STEP 3 — Spatial Join (assign country to each event)
 # ===========================================================
 print("🔍 Mapping each disaster to its country (spatial join)...")
-joined = gpd.sjoin(gdf, world[["geometry", "NAME"]], how="left", predicate="intersects")
-joined["country"] = joined["NAME"].fillna("Unknown")
+pt_idx, poly_idx = world.sindex.query(gdf.geometry, predicate="within")
+country = np.full(len(gdf), "Unknown", dtype=object)
+country[pt_idx] = world["NAME"].to_numpy()[poly_idx]
+joined = gdf.assign(country=pd.Categorical(country))
 
 # ===========================================================
 # STEP 4 — Severity Aggregation
 # ===========================================================
 print("🧮 Computing country-level severity metrics...")
 country_stats = (
-    joined.groupby("country")["magnitude"]
-    .agg(["count", "mean", "max"])
-    .rename(columns={"count": "num_events", "mean": "avg_severity", "max": "max_severity"})
-    .sort_values("avg_severity", ascending=False)
+    joined.loc[joined["country"] != "Unknown"]
+    .groupby("country", sort=False, observed=True)["magnitude"]
+    .agg(num_events="count", avg_severity="mean", max_severity="max")
 )
-country_stats = country_stats[country_stats.index != "Unknown"]
-top10 = country_stats.head(10)
+top10 = country_stats.nlargest(10, "avg_severity")
 
 print("\n🌎 Top 10 Countries by Average Severity:\n")
 print(top10)
@@ -90,16 +111,16 @@ print(top10)
 # ===========================================================
 print("\n🧩 Generating summary by disaster type...")
 type_stats = (
-    df.groupby("type")["magnitude"]
-    .agg(["count", "mean", "max"])
-    .rename(columns={"count": "num_events", "mean": "avg_magnitude", "max": "max_magnitude"})
+    df.groupby("type", sort=False, observed=True)["magnitude"]
+    .agg(num_events="count", avg_magnitude="mean", max_magnitude="max")
     .sort_values("num_events", ascending=False)
 )
 
 summary_path = os.path.join(OUTPUT_DIR, "type_summary.csv")
 for attempt in range(3):
     try:
-        type_stats.to_csv(summary_path)
+        with open(summary_path, "w", newline="", encoding="utf-8", buffering=CSV_BUFFER) as fh:
+            type_stats.to_csv(fh, lineterminator="\n")
         print(f"📄 Saved: {summary_path}\n")
         break
     except PermissionError:
@@ -124,19 +145,20 @@ print(f"🧾 Saved: {top10_file}\n")
 # ===========================================================
 print("🎨 Generating Top 10 Horizontal Bar Chart...")
 
-plt.figure(figsize=(12, 7))
+# One figure is reused for every chart below; it is cleared and resized between plots.
+fig = plt.figure(figsize=(12, 7))
+ax = fig.add_subplot()
 colors = sns.color_palette("coolwarm", len(top10))
-bars = plt.barh(top10.index[::-1], top10["avg_severity"][::-1],
-                color=colors[::-1], edgecolor="black")
-plt.xlabel("Average Severity (Magnitude)", fontsize=12)
-plt.title("Top 10 Countries by Disaster Severity", fontsize=16, weight="bold")
+bars = ax.barh(top10.index[::-1], top10["avg_severity"][::-1],
+               color=colors[::-1], edgecolor="black")
+ax.set_xlabel("Average Severity (Magnitude)", fontsize=12)
+ax.set_title("Top 10 Countries by Disaster Severity", fontsize=16, weight="bold")
 
 for i, v in enumerate(top10["avg_severity"][::-1]):
-    plt.text(v + 0.1, i, f"{v:.2f}", va='center', fontsize=10, weight='bold')
+    ax.text(v + 0.1, i, f"{v:.2f}", va='center', fontsize=10, weight='bold')
 
-plt.tight_layout()
-plt.savefig(os.path.join(OUTPUT_DIR, "top10_horizontal_bar.png"), dpi=300)
-plt.close()
+fig.tight_layout()
+fig.savefig(os.path.join(OUTPUT_DIR, "top10_horizontal_bar.png"), dpi=DPI, pil_kwargs=PNG_KWARGS)
 print("✅ Saved: output/top10_horizontal_bar.png")
 
 # ===========================================================
@@ -145,8 +167,9 @@ print("✅ Saved: output/top10_horizontal_bar.png")
 print("🌈 Generating global severity heatmap...")
 merged = world.merge(country_stats, left_on="NAME", right_on="country", how="left")
 
-plt.figure(figsize=(18, 9))
-ax = plt.gca()
+fig.clear()
+fig.set_size_inches(18, 9)
+ax = fig.add_subplot()
 merged.plot(
     column="avg_severity",
     cmap="inferno_r",
@@ -157,10 +180,9 @@ merged.plot(
     missing_kwds={"color": "lightgray", "label": "No Data"},
     ax=ax,
 )
-plt.title("🌎 Global Disaster Severity Heatmap (Last 12 Months)", fontsize=18, weight="bold", pad=20)
-plt.tight_layout()
-plt.savefig(os.path.join(OUTPUT_DIR, "global_severity_heatmap.png"), dpi=300)
-plt.close()
+ax.set_title("🌎 Global Disaster Severity Heatmap (Last 12 Months)", fontsize=18, weight="bold", pad=20)
+fig.tight_layout()
+fig.savefig(os.path.join(OUTPUT_DIR, "global_severity_heatmap.png"), dpi=DPI, pil_kwargs=PNG_KWARGS)
 print("✅ Saved: output/global_severity_heatmap.png\n")
 
 # ===========================================================
@@ -177,51 +199,53 @@ efficiency = speedups / threads
 speedup = sequential_time / parallel_time
 
 # --- Graph 1: Execution Time vs Threads ---
-plt.figure(figsize=(8, 5))
+fig.clear()
+fig.set_size_inches(8, 5)
+ax = fig.add_subplot()
 colors = ["#ff595e", "#ff924c", "#ffca3a", "#8ac926", "#1982c4"]
-plt.bar(threads.astype(str), times, color=colors, edgecolor='black', linewidth=1.2)
-plt.title("Execution Time vs Threads — Proving OpenMP Acceleration", fontsize=15, fontweight='bold', color="#222222", pad=15)
-plt.xlabel("Number of Threads", fontsize=12)
-plt.ylabel("Execution Time (ms)", fontsize=12)
-plt.grid(axis='y', linestyle='--', alpha=0.4)
+ax.bar(threads.astype(str), times, color=colors, edgecolor='black', linewidth=1.2)
+ax.set_title("Execution Time vs Threads — Proving OpenMP Acceleration", fontsize=15, fontweight='bold', color="#222222", pad=15)
+ax.set_xlabel("Number of Threads", fontsize=12)
+ax.set_ylabel("Execution Time (ms)", fontsize=12)
+ax.grid(axis='y', linestyle='--', alpha=0.4)
 for i, t in enumerate(times):
-    plt.text(i, t + 150, f"{t:.0f}", ha='center', fontsize=10, weight='bold', color="#222222")
-plt.tight_layout()
-plt.savefig(os.path.join(OUTPUT_DIR, "execution_time_vivid.png"), dpi=300)
-plt.close()
+    ax.text(i, t + 150, f"{t:.0f}", ha='center', fontsize=10, weight='bold', color="#222222")
+fig.tight_layout()
+fig.savefig(os.path.join(OUTPUT_DIR, "execution_time_vivid.png"), dpi=DPI, pil_kwargs=PNG_KWARGS)
 
 # --- Graph 2: Efficiency vs Threads ---
-plt.figure(figsize=(8, 5))
-plt.plot(threads, efficiency * 100, marker='o', markersize=8, linewidth=2.5, color="#ff595e", label="Efficiency")
-plt.fill_between(threads, efficiency * 100, color="#ffb6b9", alpha=0.3)
-plt.title("Parallel Efficiency vs Number of Threads", fontsize=15, fontweight='bold', color="#222222", pad=15)
-plt.xlabel("Number of Threads", fontsize=12)
-plt.ylabel("Efficiency (%)", fontsize=12)
-plt.ylim(0, 110)
-plt.grid(True, linestyle='--', alpha=0.5)
+fig.clear()
+fig.set_size_inches(8, 5)
+ax = fig.add_subplot()
+ax.plot(threads, efficiency * 100, marker='o', markersize=8, linewidth=2.5, color="#ff595e", label="Efficiency")
+ax.fill_between(threads, efficiency * 100, color="#ffb6b9", alpha=0.3)
+ax.set_title("Parallel Efficiency vs Number of Threads", fontsize=15, fontweight='bold', color="#222222", pad=15)
+ax.set_xlabel("Number of Threads", fontsize=12)
+ax.set_ylabel("Efficiency (%)", fontsize=12)
+ax.set_ylim(0, 110)
+ax.grid(True, linestyle='--', alpha=0.5)
 for i, e in enumerate(efficiency * 100):
-    plt.text(threads[i], e + 2, f"{e:.1f}%", ha='center', fontsize=9, weight='bold', color="#222222")
-plt.legend(frameon=False)
-plt.tight_layout()
-plt.savefig(os.path.join(OUTPUT_DIR, "efficiency_vivid.png"), dpi=300)
-plt.close()
+    ax.text(threads[i], e + 2, f"{e:.1f}%", ha='center', fontsize=9, weight='bold', color="#222222")
+ax.legend(frameon=False)
+fig.tight_layout()
+fig.savefig(os.path.join(OUTPUT_DIR, "efficiency_vivid.png"), dpi=DPI, pil_kwargs=PNG_KWARGS)
 
 # --- Graph 3: Combined Overview ---
-plt.figure(figsize=(14, 5))
-plt.subplot(1, 2, 1)
-plt.bar(threads, times, color="#4ecdc4")
-plt.title("Execution Time", fontweight='bold')
-plt.xlabel("Threads")
-plt.ylabel("Time (ms)")
-plt.subplot(1, 2, 2)
-plt.plot(threads, speedups, marker='o', color="#ff9f1c", linewidth=2, label="Speedup")
-plt.plot(threads, efficiency * 10, linestyle='--', color="#ff595e", linewidth=2, label="Efficiency (×10 scaled)")
-plt.legend()
-plt.title("Speedup & Efficiency Trends", fontweight='bold')
-plt.xlabel("Threads")
-plt.tight_layout()
-plt.savefig(os.path.join(OUTPUT_DIR, "openmp_performance_overview.png"), dpi=300)
-plt.close()
+fig.clear()
+fig.set_size_inches(14, 5)
+ax1, ax2 = fig.subplots(1, 2)
+ax1.bar(threads, times, color="#4ecdc4")
+ax1.set_title("Execution Time", fontweight='bold')
+ax1.set_xlabel("Threads")
+ax1.set_ylabel("Time (ms)")
+ax2.plot(threads, speedups, marker='o', color="#ff9f1c", linewidth=2, label="Speedup")
+ax2.plot(threads, efficiency * 10, linestyle='--', color="#ff595e", linewidth=2, label="Efficiency (×10 scaled)")
+ax2.legend()
+ax2.set_title("Speedup & Efficiency Trends", fontweight='bold')
+ax2.set_xlabel("Threads")
+fig.tight_layout()
+fig.savefig(os.path.join(OUTPUT_DIR, "openmp_performance_overview.png"), dpi=DPI, pil_kwargs=PNG_KWARGS)
+plt.close(fig)
 
 # --- Performance Summary ---
 print("\n📊 Parallel Performance Summary (OpenMP vs Sequential):")
@@ -239,7 +263,8 @@ perf_data = pd.DataFrame({
     "Efficiency_%": (efficiency * 100).round(2)
 })
 perf_path = os.path.join(OUTPUT_DIR, "openmp_performance_comparison.csv")
-perf_data.to_csv(perf_path, index=False)
+with open(perf_path, "w", newline="", encoding="utf-8", buffering=CSV_BUFFER) as fh:
+    perf_data.to_csv(fh, index=False, lineterminator="\n")
 print(f"📄 Saved: {perf_path} — detailed OpenMP performance comparison.\n")
 
 print("✅ All performance visuals and summaries generated successfully!")